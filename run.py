@@ -8,6 +8,7 @@ Usage:
     python run.py                    # Default 800x800m area
     python run.py --width 1000       # 1km x 1km area
     python run.py --parallel-only    # Skip sequential benchmark
+    python run.py --isolated ...     # Run in a separate interpreter
 """
 
 import subprocess
@@ -16,18 +17,27 @@ from pathlib import Path
 
 def main():
     script = Path(__file__).parent / 'scripts' / 'generate_dataset.py'
-    
+
     # Pass all arguments to generate_dataset.py
-    args = [sys.executable, str(script)] + sys.argv[1:]
-    
+    args = sys.argv[1:]
+
     # Default to parallel-only for quick demo
-    if len(sys.argv) == 1:
-        args.extend(['--width', '800', '--height', '800', '--parallel-only'])
+    if not args:
+        args = ['--width', '800', '--height', '800', '--parallel-only']
         print("Running quick demo (800x800m, parallel only)...")
         print("For full benchmark: python run.py --width 800 --height 800")
         print()
-    
-    subprocess.run(args)
+
+    if '--isolated' in args:
+        args.remove('--isolated')
+        subprocess.run([sys.executable, str(script)] + args)
+        return
+
+    # Run in-process: avoids a second interpreter startup + import cycle
+    sys.path.insert(0, str(script.parent))
+    from generate_dataset import main as generate_main
+    sys.argv = [str(script)] + args
+    generate_main()
 
 
 if __name__ == '__main__':
@@ -23,15 +23,40 @@ import os
 import sys
 import csv
 import time
+import shutil
 import json
 import math
 import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 from PIL import Image
 
 # Handle large images
 Image.MAX_IMAGE_PIXELS = None
 
+# Optional SIMD resize (OpenCV); PIL Lanczos fallback if unavailable
+try:
+    import cv2
+    HAS_CV2 = True
+except ImportError:
+    HAS_CV2 = False
+
+# Optional C-level CSV writer; stdlib csv fallback if unavailable
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+# Optional rigorous WGS84<->UTM projection; flat-earth fallback otherwise
+try:
+    from pyproj import Transformer
+    HAS_PYPROJ = True
+except ImportError:
+    HAS_PYPROJ = False
+
 sys.path.insert(0, str(Path(__file__).parent))
 
 try:
@@ -40,13 +65,62 @@ try:
 except ImportError:
     pass
 
-from maps_core import latlon_to_pixel, pixel_to_latlon, calculate_tile_grid
+# Optional fast JSON serializer; stdlib json fallback if unavailable
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_json(obj, path):
+    """Write indented JSON, using orjson when available."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w') as f:
+            json.dump(obj, f, indent=2)
+
+
+from maps_core import latlon_to_pixel, pixel_to_latlon, calculate_tile_grid, write_reference_grid
 from maps_fast import download_satellite_map_fast
 from maps_sequential import download_satellite_map_sequential
+from maps_async import download_satellite_map_async
 
 OUTPUT_DIR = Path(__file__).parent.parent / 'output'
 
 
+class RefTileTable:
+    """
+    Column-oriented reference tile metadata.
+
+    Holds one NumPy array per numeric field plus the filename list
+    instead of a dict per tile - roughly 8x less memory for large ref
+    sets and a straight columnar hand-off to the CSV writers.
+    """
+
+    FIELDS = ['id', 'filename', 'x_px', 'y_px', 'x1_px', 'y1_px', 'lat', 'lon', 'size_px']
+
+    def __init__(self, filenames, x_px, y_px, lats, lons, tile_size):
+        n = len(filenames)
+        self.id = np.arange(n)
+        self.filename = filenames
+        self.x_px = x_px
+        self.y_px = y_px
+        self.x1_px = x_px - tile_size // 2
+        self.y1_px = y_px - tile_size // 2
+        self.lat = lats
+        self.lon = lons
+        self.size_px = np.full(n, tile_size)
+
+    def __len__(self):
+        return len(self.filename)
+
+    def columns(self) -> dict:
+        """Field name -> column, in CSV order."""
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+
 def meters_to_degrees(meters: float, lat: float, direction: str = 'lat') -> float:
     """Convert meters to degrees at given latitude."""
     if direction == 'lat':
@@ -63,7 +137,22 @@ def calculate_bounds(
     up_m: float,
     down_m: float
 ) -> tuple:
-    """Calculate bounding box from center point and distances in meters."""
+    """Calculate bounding box from center point and distances in meters.
+
+    Uses a true WGS84->UTM projection (PROJ, in C) when pyproj is
+    installed, which stays accurate for multi-km extents; otherwise
+    falls back to the flat-earth approximation.
+    """
+    if HAS_PYPROJ:
+        utm_zone = int((center_lon + 180) / 6) + 1
+        utm_epsg = (32600 if center_lat >= 0 else 32700) + utm_zone
+        to_utm = Transformer.from_crs('EPSG:4326', f'EPSG:{utm_epsg}', always_xy=True)
+        to_wgs = Transformer.from_crs(f'EPSG:{utm_epsg}', 'EPSG:4326', always_xy=True)
+        cx, cy = to_utm.transform(center_lon, center_lat)
+        lon_min, lat_min = to_wgs.transform(cx - left_m, cy - down_m)
+        lon_max, lat_max = to_wgs.transform(cx + right_m, cy + up_m)
+        return (lat_min, lat_max, lon_min, lon_max)
+
     lat_up = meters_to_degrees(up_m, center_lat, 'lat')
     lat_down = meters_to_degrees(down_m, center_lat, 'lat')
     lon_left = meters_to_degrees(left_m, center_lat, 'lon')
@@ -84,6 +173,9 @@ def create_reference_database(
     spacing: int,
     bounds: tuple,
     zoom: int,
+    archive: bool = False,
+    pixel_format: str = 'jpeg',
+    mosaic_array=None,
     verbose: bool = True
 ) -> list:
     """
@@ -96,59 +188,63 @@ def create_reference_database(
         spacing: Spacing between tile centers in pixels
         bounds: (lat_min, lat_max, lon_min, lon_max)
         zoom: Zoom level used
+        archive: Pack tiles into a single ref.tar next to output_dir
+            instead of one JPEG file per tile
+        pixel_format: 'jpeg' (default), 'npy' (raw pixel memmap only)
+            or 'both'
+        mosaic_array: Already-decoded (H, W, 3) uint8 mosaic; skips the
+            mosaic_path decode entirely when the caller still holds the
+            pixels from stitching
     
     Returns:
-        List of tile metadata dicts
+        RefTileTable with one column per metadata field
     """
     os.makedirs(output_dir, exist_ok=True)
-    
-    img = Image.open(mosaic_path)
-    width, height = img.size
-    
+
+    if mosaic_array is not None:
+        arr = mosaic_array
+    elif str(mosaic_path).endswith('.npy'):
+        # Memory-mapped raw mosaic: pages are faulted in as tiles touch
+        # them, so the whole image never has to be resident at once
+        arr = np.load(mosaic_path, mmap_mode='r')
+    else:
+        # Decode the mosaic once; tiles are zero-copy views into this array
+        arr = np.asarray(Image.open(mosaic_path).convert('RGB'))
+    height, width = arr.shape[:2]
+
     lat_min, lat_max, lon_min, lon_max = bounds
-    
+
     # Calculate pixel to geo mapping
     px_per_lon = width / (lon_max - lon_min)
     px_per_lat = height / (lat_max - lat_min)
-    
-    tiles = []
-    tile_idx = 0
+
     half = tile_size // 2
-    
-    # Generate tiles with specified spacing
-    for y in range(half, height - half, spacing):
-        for x in range(half, width - half, spacing):
-            # Extract tile
-            x1, y1 = x - half, y - half
-            x2, y2 = x + half, y + half
-            
-            tile = img.crop((x1, y1, x2, y2))
-            
-            # Calculate geo coordinates of tile center
-            tile_lon = lon_min + x / px_per_lon
-            tile_lat = lat_max - y / px_per_lat  # Y is inverted
-            
-            # Save tile
-            filename = f"tile_{tile_idx:05d}.jpg"
-            filepath = os.path.join(output_dir, filename)
-            tile.save(filepath, 'JPEG', quality=90)
-            tile.close()
-            
-            tiles.append({
-                'id': tile_idx,
-                'filename': filename,
-                'x_px': x,
-                'y_px': y,
-                'x1_px': x1,
-                'y1_px': y1,
-                'lat': tile_lat,
-                'lon': tile_lon,
-                'size_px': tile_size
-            })
-            
-            tile_idx += 1
-    
-    img.close()
+
+    # Vectorized tile centers and geo coordinates (one C pass instead of a
+    # Python double loop)
+    xs = np.arange(half, width - half, spacing)
+    ys = np.arange(half, height - half, spacing)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    grid_x = grid_x.ravel()
+    grid_y = grid_y.ravel()
+
+    lons = lon_min + grid_x / px_per_lon
+    lats = lat_max - grid_y / px_per_lat  # Y is inverted
+
+    filenames = [f"tile_{i:05d}.jpg" for i in range(len(grid_x))]
+    tiles = RefTileTable(filenames, grid_x, grid_y, lats, lons, tile_size)
+
+    archive_path = os.path.join(os.path.dirname(output_dir), 'ref.tar') if archive else None
+    npy_path = os.path.join(os.path.dirname(output_dir), 'refs.npy') if pixel_format in ('npy', 'both') else None
+
+    write_reference_grid(
+        arr, output_dir, tile_size, spacing,
+        num_rows=len(ys), num_cols=len(xs),
+        filenames=filenames,
+        archive_path=archive_path,
+        npy_path=npy_path,
+        write_jpeg=pixel_format != 'npy'
+    )
     
     if verbose:
         print(f"[RefDB] Generated {len(tiles)} reference tiles")
@@ -156,17 +252,71 @@ def create_reference_database(
     return tiles
 
 
-def save_ref_csv(tiles: list, output_path: str):
+def _batch_refs_worker(args):
+    """Top-level worker (picklable) for create_reference_database_batch."""
+    mosaic_path, tile_size, spacing, bounds, zoom = args
+    stem = os.path.splitext(mosaic_path)[0]
+    tiles = create_reference_database(
+        mosaic_path, stem + '_ref',
+        tile_size=tile_size, spacing=spacing,
+        bounds=bounds, zoom=zoom,
+        verbose=False
+    )
+    save_ref_csv(tiles, stem + '_ref.csv')
+    return mosaic_path, len(tiles)
+
+
+def create_reference_database_batch(
+    mosaic_paths: list,
+    tile_size: int,
+    spacing: int,
+    bounds: tuple,
+    zoom: int,
+    verbose: bool = True
+) -> list:
+    """
+    Build reference databases for several mosaics in parallel.
+
+    Each mosaic is handled by its own process (decode + encode bypass the
+    GIL entirely), writing <mosaic>_ref/ and <mosaic>_ref.csv next to it.
+
+    Returns:
+        List of (mosaic_path, tile_count) tuples
+    """
+    jobs = [(str(p), tile_size, spacing, bounds, zoom) for p in mosaic_paths]
+
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count())) as executor:
+        results = list(executor.map(_batch_refs_worker, jobs))
+
+    if verbose:
+        for path, count in results:
+            print(f"[RefDB] {path}: {count} reference tiles")
+
+    return results
+
+
+def save_ref_csv(tiles: RefTileTable, output_path: str):
     """Save tile metadata to CSV."""
     if not tiles:
         return
-    
-    fieldnames = ['id', 'filename', 'x_px', 'y_px', 'x1_px', 'y1_px', 'lat', 'lon', 'size_px']
-    
+
+    columns = tiles.columns()
+
+    if HAS_PANDAS:
+        # C row formatter + one buffered flush; noticeably faster than
+        # the Python csv module on large ref sets
+        pd.DataFrame(columns).to_csv(output_path, index=False)
+        return
+
+    rows = zip(*(
+        col if isinstance(col, list) else col.tolist()
+        for col in columns.values()
+    ))
+
     with open(output_path, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(tiles)
+        writer = csv.writer(f)
+        writer.writerow(columns.keys())
+        writer.writerows(rows)
 
 
 def run_pipeline(
@@ -176,11 +326,16 @@ def run_pipeline(
     tile_size: int,
     spacing: int,
     workers: int = None,
+    use_async: bool = False,
+    adaptive: bool = False,
+    cache_dir: str = None,
+    ref_archive: bool = False,
+    ref_format: str = 'jpeg',
     verbose: bool = True
 ) -> dict:
     """
     Run complete dataset generation pipeline.
-    
+
     Args:
         name: Output folder name ('parallel' or 'sequential')
         bounds: (lat_min, lat_max, lon_min, lon_max)
@@ -188,7 +343,12 @@ def run_pipeline(
         tile_size: Reference tile size in pixels
         spacing: Spacing between tile centers in pixels
         workers: Number of parallel workers (None for sequential)
-    
+        use_async: Use asyncio/aiohttp downloader for the parallel method
+        adaptive: Enable AIMD concurrency control for the parallel method
+        cache_dir: Persistent tile cache directory (None disables caching)
+        ref_archive: Pack reference tiles into a single ref.tar
+        ref_format: Reference tile pixel format ('jpeg', 'npy' or 'both')
+
     Returns:
         Results dictionary
     """
@@ -206,13 +366,22 @@ def run_pipeline(
     # Download tiles and stitch mosaic
     start = time.time()
     
-    if workers:
+    if workers and use_async:
+        mosaic, meta = download_satellite_map_async(
+            bounds[0], bounds[1], bounds[2], bounds[3],
+            zoom=zoom,
+            max_concurrent=workers,
+            verbose=verbose
+        )
+    elif workers:
         mosaic, meta = download_satellite_map_fast(
             bounds[0], bounds[1], bounds[2], bounds[3],
             zoom=zoom,
             max_workers=workers,
             verbose=verbose,
-            use_disk=True
+            use_disk=True,
+            adaptive=adaptive,
+            cache_dir=cache_dir
         )
     else:
         mosaic, meta = download_satellite_map_sequential(
@@ -230,23 +399,40 @@ def run_pipeline(
     
     # Save high quality map
     print(f"[{name}] Saving map.jpg...")
-    mosaic.save(str(map_path), 'JPEG', quality=90)
+    mosaic.save(str(map_path), 'JPEG', quality=90, optimize=False, progressive=False, subsampling=2)
     mosaic_size = mosaic.size
+
+    # One decode for the rest of the pipeline: the compressed map and the
+    # ref tiles both reuse these pixels instead of re-reading map.jpg
+    mosaic_arr = np.asarray(mosaic.convert('RGB'))
     
     # Save compressed map for visualization (max 4000px, lower quality)
     compressed_path = method_dir / 'compressed_map.jpg'
-    print(f"[{name}] Saving compressed_map.jpg...")
-    max_dim = 4000
-    if mosaic_size[0] > max_dim or mosaic_size[1] > max_dim:
-        ratio = min(max_dim / mosaic_size[0], max_dim / mosaic_size[1])
-        new_size = (int(mosaic_size[0] * ratio), int(mosaic_size[1] * ratio))
-        compressed = mosaic.resize(new_size, Image.LANCZOS)
-        compressed.save(str(compressed_path), 'JPEG', quality=75)
-        compressed.close()
-    else:
-        mosaic.save(str(compressed_path), 'JPEG', quality=75)
-    
-    mosaic.close()
+
+    def save_compressed():
+        max_dim = 4000
+        if mosaic_size[0] > max_dim or mosaic_size[1] > max_dim:
+            ratio = min(max_dim / mosaic_size[0], max_dim / mosaic_size[1])
+            new_size = (int(mosaic_size[0] * ratio), int(mosaic_size[1] * ratio))
+            if HAS_CV2:
+                # INTER_AREA is the right filter for heavy downscale and runs
+                # in SIMD C++, much faster than PIL Lanczos on a huge mosaic
+                small = cv2.resize(mosaic_arr, new_size, interpolation=cv2.INTER_AREA)
+                cv2.imwrite(str(compressed_path), small[:, :, ::-1], [cv2.IMWRITE_JPEG_QUALITY, 75])
+            else:
+                compressed = mosaic.resize(new_size, Image.LANCZOS)
+                compressed.save(str(compressed_path), 'JPEG', quality=75, optimize=False, progressive=False, subsampling=2)
+                compressed.close()
+        else:
+            # No downscale needed: a byte copy of map.jpg beats re-encoding
+            # the full mosaic at a lower quality it doesn't benefit from
+            shutil.copyfile(str(map_path), str(compressed_path))
+
+    # The resize/encode runs in C with the GIL released, so it overlaps
+    # cleanly with reference-tile generation below
+    print(f"[{name}] Saving compressed_map.jpg (background)...")
+    compress_thread = threading.Thread(target=save_compressed)
+    compress_thread.start()
     
     # Generate reference database
     print(f"[{name}] Generating reference tiles...")
@@ -257,8 +443,14 @@ def run_pipeline(
         spacing=spacing,
         bounds=bounds,
         zoom=zoom,
+        archive=ref_archive,
+        pixel_format=ref_format,
+        mosaic_array=mosaic_arr,
         verbose=verbose
     )
+
+    compress_thread.join()
+    mosaic.close()
     
     # Save CSV
     print(f"[{name}] Saving ref.csv...")
@@ -282,8 +474,7 @@ def run_pipeline(
     }
     
     # Save results JSON
-    with open(method_dir / 'results.json', 'w') as f:
-        json.dump(result, f, indent=2)
+    dump_json(result, method_dir / 'results.json')
     
     print(f"[{name}] Done: {download_time:.1f}s download, {throughput:.1f} t/s, {len(tiles)} refs")
     
@@ -317,6 +508,15 @@ def main():
     
     # Processing
     parser.add_argument('--workers', type=int, default=60, help='Parallel workers')
+    parser.add_argument('--use-async', action='store_true', help='Use asyncio/aiohttp for parallel download')
+    parser.add_argument('--adaptive', action='store_true', help='Adaptive (AIMD) concurrency control')
+    parser.add_argument('--cache', action='store_true', help='Cache downloaded tiles in .tile_cache for re-runs')
+    parser.add_argument('--ref-archive', action='store_true', help='Pack reference tiles into a single ref.tar')
+    parser.add_argument('--ref-format', choices=['jpeg', 'npy', 'both'], default='jpeg',
+                        help='Reference tile output format (npy = raw pixel memmap)')
+    parser.add_argument('--refs-only', nargs='+', metavar='MOSAIC',
+                        help='Skip download; build reference databases for these mosaics '
+                             '(uses the bounds derived from --lat/--lon/--width/--height)')
     parser.add_argument('--parallel-only', action='store_true', help='Skip sequential')
     parser.add_argument('--sequential-only', action='store_true', help='Skip parallel')
     
@@ -333,7 +533,17 @@ def main():
     
     coverage_width = left + right
     coverage_height = up + down
-    
+
+    if args.refs_only:
+        create_reference_database_batch(
+            args.refs_only,
+            tile_size=args.tile_size,
+            spacing=args.spacing,
+            bounds=bounds,
+            zoom=args.zoom
+        )
+        return
+
     OUTPUT_DIR.mkdir(exist_ok=True)
     
     print("=" * 70)
@@ -353,7 +563,12 @@ def main():
         results['parallel'] = run_pipeline(
             'parallel', bounds, args.zoom,
             args.tile_size, args.spacing,
-            workers=args.workers
+            workers=args.workers,
+            use_async=args.use_async,
+            adaptive=args.adaptive,
+            cache_dir=str(Path(__file__).parent.parent / '.tile_cache') if args.cache else None,
+            ref_archive=args.ref_archive,
+            ref_format=args.ref_format
         )
     
     # Sequential
@@ -361,7 +576,9 @@ def main():
         results['sequential'] = run_pipeline(
             'sequential', bounds, args.zoom,
             args.tile_size, args.spacing,
-            workers=None
+            workers=None,
+            ref_archive=args.ref_archive,
+            ref_format=args.ref_format
         )
     
     # Summary
@@ -381,8 +598,7 @@ def main():
             results['speedup'] = speedup
     
     # Save combined results
-    with open(OUTPUT_DIR / 'benchmark_results.json', 'w') as f:
-        json.dump(results, f, indent=2)
+    dump_json(results, OUTPUT_DIR / 'benchmark_results.json')
     
     print(f"\n{'='*70}")
     print("OUTPUT FILES")
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Async Google Maps Satellite Downloader
+=======================================
+asyncio + aiohttp tile fetching: thousands of in-flight requests without
+per-thread overhead. Falls back with a clear error if aiohttp is missing.
+"""
+
+import os
+import sys
+import time
+import ssl
+import asyncio
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, Dict, List
+from PIL import Image
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# Optional c-ares resolver: parallel DNS instead of threaded getaddrinfo
+try:
+    import aiodns  # noqa: F401 - presence check for aiohttp.AsyncResolver
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
+
+# Optional HTTP/2 backend: multiplexes all tile GETs over a few TLS
+# connections instead of one connection per in-flight request
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+# One TLS context for the whole process so session tickets are reused
+# across tile connections instead of full handshakes
+_ssl_context = ssl.create_default_context()
+
+# Optional DCT-domain crop (libjpeg-turbo): drops the watermark strip
+# without a decode+re-encode round trip
+try:
+    from turbojpeg import TurboJPEG
+    _turbo = TurboJPEG()
+except Exception:
+    _turbo = None
+
+sys.path.insert(0, os.path.dirname(__file__))
+from maps_core import calculate_tile_grid, stitch_mosaic
+from maps_fast import make_url_signer
+
+
+async def download_tile_async(
+    session,
+    req: Dict,
+    sign,
+    crop_bottom: int,
+    max_retries: int = 5
+) -> Dict:
+    """Fetch a single tile's bytes, with 429/5xx retries.
+
+    Decoding is deliberately left to the batch decode stage after the
+    download completes, so async tasks stay pure I/O and the event loop
+    never waits behind CPU work.
+    """
+    url = sign(req['lat'], req['lon'])
+
+    for attempt in range(max_retries):
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    if response.headers.get('content-type', '').startswith('image'):
+                        data = await response.read()
+                        return {
+                            'row': req['row'],
+                            'col': req['col'],
+                            'index': req['index'],
+                            'image': None,
+                            'data': data,
+                            'success': True
+                        }
+                    break
+                elif response.status == 429:
+                    await asyncio.sleep(0.1 * (attempt + 1))
+                elif response.status >= 500:
+                    await asyncio.sleep(0.05 * (attempt + 1))
+                else:
+                    break
+        except asyncio.TimeoutError:
+            await asyncio.sleep(0.1)
+        except Exception:
+            await asyncio.sleep(0.05)
+
+    return {
+        'row': req['row'],
+        'col': req['col'],
+        'index': req['index'],
+        'image': None,
+        'data': None,
+        'success': False
+    }
+
+
+async def download_tile_httpx(
+    client,
+    req: Dict,
+    sign,
+    crop_bottom: int,
+    max_retries: int = 5
+) -> Dict:
+    """httpx twin of download_tile_async; same retry policy over HTTP/2."""
+    url = sign(req['lat'], req['lon'])
+
+    for attempt in range(max_retries):
+        try:
+            response = await client.get(url)
+            if response.status_code == 200:
+                if response.headers.get('content-type', '').startswith('image'):
+                    return {
+                        'row': req['row'],
+                        'col': req['col'],
+                        'index': req['index'],
+                        'image': None,
+                        'data': response.content,
+                        'success': True
+                    }
+                break
+            elif response.status_code == 429:
+                await asyncio.sleep(0.1 * (attempt + 1))
+            elif response.status_code >= 500:
+                await asyncio.sleep(0.05 * (attempt + 1))
+            else:
+                break
+        except httpx.TimeoutException:
+            await asyncio.sleep(0.1)
+        except Exception:
+            await asyncio.sleep(0.05)
+
+    return {
+        'row': req['row'],
+        'col': req['col'],
+        'index': req['index'],
+        'image': None,
+        'data': None,
+        'success': False
+    }
+
+
+def _crop_bytes_lossless(data: bytes, crop_bottom: int) -> Optional[bytes]:
+    """Crop the attribution strip in the DCT domain, without decoding.
+
+    Returns None when libjpeg-turbo is unavailable or the crop fails
+    (e.g. height not aligned to the MCU grid), in which case the caller
+    falls back to the decode path.
+    """
+    if _turbo is None or crop_bottom <= 0:
+        return None
+    try:
+        w, h = Image.open(BytesIO(data)).size
+        return _turbo.crop(data, 0, 0, w, h - crop_bottom)
+    except Exception:
+        return None
+
+
+def _decode_and_crop(data: bytes, crop_bottom: int) -> Tuple[Optional[Image.Image], Optional[bytes]]:
+    """Decode JPEG bytes, cropping the attribution strip.
+
+    Returns (image, cropped_bytes). cropped_bytes is the tile already
+    cropped in compressed form - either the original response when no
+    crop is needed or a lossless DCT-domain crop - so byte-oriented
+    consumers can write it straight to disk without a re-encode. It is
+    None when only the decoded crop is available.
+    """
+    try:
+        if crop_bottom <= 0:
+            return Image.open(BytesIO(data)), data
+        cropped = _crop_bytes_lossless(data, crop_bottom)
+        if cropped is not None:
+            return Image.open(BytesIO(cropped)), cropped
+        img = Image.open(BytesIO(data))
+        w, h = img.size
+        return img.crop((0, 0, w, h - crop_bottom)), None
+    except Exception:
+        return None, None
+
+
+async def download_all_tiles_async(
+    tile_requests: List[Dict],
+    zoom: int, tile_size_px: int, scale: int,
+    api_key: str, secret: str,
+    crop_bottom: int,
+    max_concurrent: int,
+    verbose: bool = True,
+    http2: bool = False
+) -> List[Dict]:
+    """Download all tiles concurrently, then decode them in parallel.
+
+    Concurrency is bounded by a pool of worker coroutines pulling from a
+    queue rather than a task per tile behind a semaphore: thousands of
+    parked tasks disappear from the event loop and per-tile scheduling
+    cost drops to one queue pop.
+
+    With http2=True (and httpx installed) all GETs multiplex over a few
+    HTTP/2 connections instead of one TCP+TLS connection per in-flight
+    request.
+    """
+    total_tiles = len(tile_requests)
+    start_time = time.time()
+
+    sign = make_url_signer(zoom, tile_size_px, scale, api_key, secret)
+
+    queue = asyncio.Queue()
+    for req in tile_requests:
+        queue.put_nowait(req)
+
+    # Slot each result by tile index: O(N) placement, no final sort
+    results = [None] * total_tiles
+    progress = {'completed': 0, 'last_report': 0}
+
+    async def worker(client, fetch):
+        while True:
+            try:
+                req = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = await fetch(client, req, sign, crop_bottom)
+            results[result['index']] = result
+            progress['completed'] += 1
+            completed = progress['completed']
+            if verbose and (completed - progress['last_report'] >= 50 or completed == total_tiles):
+                elapsed = time.time() - start_time
+                rate = completed / elapsed if elapsed > 0 else 0
+                print(f"[Async]   Progress: {completed}/{total_tiles} ({rate:.1f} t/s)")
+                progress['last_report'] = completed
+
+    num_workers = min(max_concurrent, total_tiles)
+
+    if http2 and HAS_HTTPX:
+        limits = httpx.Limits(
+            max_connections=max_concurrent,
+            max_keepalive_connections=max_concurrent
+        )
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=30) as client:
+            await asyncio.gather(*(
+                worker(client, download_tile_httpx) for _ in range(num_workers)
+            ))
+    else:
+        # Hold connections open across the whole run so each tile after the
+        # first rides an already-established TCP+TLS connection
+        connector = aiohttp.TCPConnector(
+            limit=max_concurrent,
+            limit_per_host=max_concurrent,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
+            resolver=aiohttp.AsyncResolver() if HAS_AIODNS else None,
+            ssl=_ssl_context
+        )
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(
+                worker(session, download_tile_async) for _ in range(num_workers)
+            ))
+
+    # Batch decode on all cores (libjpeg releases the GIL); raw bytes in
+    # each result are replaced by the cropped-bytes passthrough when the
+    # DCT-domain crop applies
+    def materialize(result):
+        if result is not None and result['data'] is not None:
+            img, raw = _decode_and_crop(result['data'], crop_bottom)
+            result['image'] = img
+            result['data'] = raw
+            result['success'] = img is not None
+        return result
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(materialize, results))
+
+    return results
+
+
+def download_satellite_map_async(
+    lat_min: float, lat_max: float,
+    lon_min: float, lon_max: float,
+    zoom: int = 19,
+    tile_size_px: int = 640,
+    scale: int = 2,
+    crop_bottom: int = 40,
+    api_key: str = None,
+    secret: str = None,
+    max_concurrent: int = 50,
+    verbose: bool = True,
+    output_path: str = None,
+    http2: bool = False
+) -> Tuple[Optional[Image.Image], Optional[Dict]]:
+    """
+    Download satellite mosaic using async I/O.
+
+    Args:
+        max_concurrent: Maximum in-flight HTTP requests
+        output_path: Save mosaic directly to this path
+        http2: Multiplex over HTTP/2 via httpx (needs httpx[http2])
+
+    Returns:
+        (mosaic_image, metadata)
+    """
+    if http2 and not HAS_HTTPX:
+        print("[Async] WARNING: httpx not installed, falling back to aiohttp")
+        http2 = False
+    if not http2 and not HAS_AIOHTTP:
+        print("[Async] ERROR: aiohttp not installed (pip install aiohttp)")
+        return None, None
+
+    if api_key is None:
+        api_key = os.environ.get('GOOGLE_MAPS_API_KEY') or os.environ.get('GMAPS_KEY')
+    if secret is None:
+        secret = os.environ.get('GOOGLE_MAPS_SECRET')
+
+    if not api_key:
+        print("[Async] ERROR: No API key!")
+        return None, None
+
+    tile_requests, num_rows, num_cols, metadata = calculate_tile_grid(
+        lat_min, lat_max, lon_min, lon_max, zoom, tile_size_px
+    )
+    total_tiles = len(tile_requests)
+
+    if verbose:
+        print(f"[Async] Downloading {total_tiles} tiles ({num_rows}x{num_cols})")
+        print(f"[Async]   Max concurrent: {max_concurrent}")
+        print(f"[Async]   URL signing: {'YES' if secret else 'NO'}")
+
+    start_time = time.time()
+
+    results = asyncio.run(download_all_tiles_async(
+        tile_requests, zoom, tile_size_px, scale,
+        api_key, secret, crop_bottom,
+        max_concurrent, verbose, http2=http2
+    ))
+
+    download_time = time.time() - start_time
+    success_count = sum(1 for r in results if r['success'])
+
+    if verbose:
+        print(f"[Async] Downloaded {success_count}/{total_tiles} in {download_time:.2f}s")
+        print(f"[Async]   Throughput: {success_count/download_time:.1f} tiles/sec")
+        print(f"[Async] Stitching...")
+
+    tiles_for_stitch = [{'row': r['row'], 'col': r['col'], 'image': r['image']} for r in results]
+    mosaic = stitch_mosaic(tiles_for_stitch, num_rows, num_cols, tile_size_px, scale, crop_bottom)
+
+    if output_path:
+        mosaic.save(output_path, 'JPEG', quality=85, optimize=False, progressive=False, subsampling=2)
+
+    if verbose:
+        print(f"[Async] Mosaic: {mosaic.size[0]}x{mosaic.size[1]} px")
+
+    elapsed = time.time() - start_time
+
+    metadata['download_method'] = 'async'
+    metadata['max_concurrent'] = max_concurrent
+    metadata['tiles_success'] = success_count
+    metadata['tiles_total'] = total_tiles
+    metadata['download_time'] = download_time
+    metadata['total_time'] = elapsed
+    metadata['throughput'] = success_count / download_time if download_time > 0 else 0
+    metadata['url_signing'] = secret is not None
+
+    return mosaic, metadata
@@ -11,7 +11,7 @@ import sys
 import time
 import tempfile
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional, Dict, List
 from PIL import Image
 import requests
@@ -23,103 +23,253 @@ import base64
 from urllib.parse import urlencode
 from io import BytesIO
 import threading
+import numpy as np
 
 sys.path.insert(0, os.path.dirname(__file__))
-from maps_core import calculate_tile_grid, stitch_mosaic, stitch_mosaic_streaming
+from maps_core import calculate_tile_grid, save_jpeg
 
+# Optional SIMD JPEG decoder (libjpeg-turbo); PIL fallback if unavailable
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo = TurboJPEG()
+except Exception:
+    _turbo = None
 
-class FastSessionPool:
-    """Thread-local session pool optimized for high throughput."""
-    def __init__(self, pool_size: int = 100):
-        self._local = threading.local()
-        self._pool_size = pool_size
-    
-    def get(self):
-        if not hasattr(self._local, 'session'):
-            session = requests.Session()
-            # No automatic retries - we handle 429 manually
-            adapter = HTTPAdapter(
-                pool_connections=self._pool_size,
-                pool_maxsize=self._pool_size,
-                max_retries=0  # We handle retries manually for speed
-            )
-            session.mount('https://', adapter)
-            self._local.session = session
-        return self._local.session
 
+_session = None
+_session_lock = threading.Lock()
 
-_pool = FastSessionPool(100)
 
+def get_fast_session(pool_size: int = 100) -> requests.Session:
+    """
+    One shared session for all download threads.
 
-def build_signed_url(lat, lon, zoom, tile_size_px, scale, api_key, secret):
-    """Build signed URL for Google Maps Static API."""
-    params = {
-        'center': f'{lat:.10f},{lon:.10f}',
+    requests.Session.get() is thread-safe, and a single urllib3 pool
+    means established TLS connections are reused across the whole worker
+    pool instead of each thread handshaking its own.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # No automatic retries - we handle 429 manually
+                adapter = HTTPAdapter(
+                    pool_connections=pool_size,
+                    pool_maxsize=pool_size * 2,
+                    max_retries=0  # We handle retries manually for speed
+                )
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency controller.
+
+    Starts at `initial` concurrent downloads, adds one slot per `batch`
+    successful responses, and halves on HTTP 429 so throughput settles
+    near the API's real rate limit without manual tuning.
+    """
+    def __init__(self, initial: int, minimum: int = 4, maximum: int = None, batch: int = 20):
+        self._limit = initial
+        self._min = minimum
+        self._max = maximum if maximum else initial
+        self._batch = batch
+        self._successes = 0
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        """Additive increase: one extra slot per batch of clean responses."""
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self._batch and self._limit < self._max:
+                self._successes = 0
+                self._limit += 1
+                self._cond.notify()
+
+    def on_throttle(self):
+        """Multiplicative decrease on rate limiting."""
+        with self._cond:
+            self._successes = 0
+            self._limit = max(self._min, self._limit // 2)
+
+
+def make_url_signer(zoom: int, tile_size_px: int, scale: int, api_key: str, secret: str):
+    """
+    Build a per-session URL signer: lat/lon in, signed URL out.
+
+    The base64 secret decode, the HMAC-SHA1 key schedule and the static
+    query parameters are all computed once here instead of per tile, so
+    the per-call work is one format, one digest copy+update and one
+    b64encode.
+    """
+    suffix = urlencode({
         'zoom': zoom,
         'size': f'{tile_size_px}x{tile_size_px}',
         'scale': scale,
         'maptype': 'satellite',
         'format': 'jpg',
         'key': api_key
-    }
-    
-    if secret:
-        path = "/maps/api/staticmap"
-        query = urlencode(params, doseq=True)
-        resource = f"{path}?{query}"
-        decoded_secret = base64.urlsafe_b64decode(secret)
-        signature = hmac.new(decoded_secret, resource.encode('utf-8'), hashlib.sha1)
-        encoded_signature = base64.urlsafe_b64encode(signature.digest()).decode('utf-8')
-        return f"https://maps.googleapis.com{resource}&signature={encoded_signature}"
-    else:
-        return "https://maps.googleapis.com/maps/api/staticmap?" + urlencode(params)
+    })
+    path = "/maps/api/staticmap"
+
+    if not secret:
+        def sign(lat, lon):
+            return f"https://maps.googleapis.com{path}?center={lat:.10f}%2C{lon:.10f}&{suffix}"
+        return sign
+
+    template = hmac.new(base64.urlsafe_b64decode(secret), b'', hashlib.sha1)
+
+    def sign(lat, lon):
+        resource = f"{path}?center={lat:.10f}%2C{lon:.10f}&{suffix}"
+        h = template.copy()
+        h.update(resource.encode('utf-8'))
+        signature = base64.urlsafe_b64encode(h.digest()).decode('utf-8')
+        return f"https://maps.googleapis.com{resource}&signature={signature}"
+    return sign
+
+
+def build_signed_url(lat, lon, zoom, tile_size_px, scale, api_key, secret):
+    """Build a single signed URL (one-shot wrapper around make_url_signer)."""
+    return make_url_signer(zoom, tile_size_px, scale, api_key, secret)(lat, lon)
+
+
+def _tile_cache_path(cache_dir: str, lat: float, lon: float, zoom: int, tile_size_px: int, scale: int) -> str:
+    """Cache filename keyed by the request parameters that define a tile."""
+    return os.path.join(cache_dir, f"z{zoom}_{lat:.10f}_{lon:.10f}_{tile_size_px}_{scale}.jpg")
+
+
+_decode_local = threading.local()
+
+
+def _process_tile_bytes(data: bytes) -> Tuple[bool, Optional[Image.Image]]:
+    """Decode raw tile bytes.
+
+    No cropping here: the attribution strip is clipped for free when the
+    tile is slice-assigned into the mosaic, which saves an image-sized
+    copy per tile.
+    """
+    if _turbo is not None:
+        # SIMD decode straight to RGB
+        return True, Image.fromarray(_turbo.decode(data, pixel_format=TJPF_RGB))
+
+    # Reuse one buffer per worker thread instead of allocating a fresh
+    # BytesIO for every tile; draft() lets libjpeg skip colorspace work
+    # when the source is already RGB
+    buf = getattr(_decode_local, 'buf', None)
+    if buf is None:
+        buf = _decode_local.buf = BytesIO()
+    buf.seek(0)
+    buf.truncate()
+    buf.write(data)
+    buf.seek(0)
+    img = Image.open(buf)
+    img.draft('RGB', img.size)
+    img.load()  # finish with buf before the next tile reuses it
+    return True, img
+
+
+def _write_tile_bytes(data: bytes, output_path: str) -> Tuple[bool, None]:
+    """Persist the JPEG response verbatim - no decode, no re-encode.
+
+    The attribution strip is still present in the stored file; the
+    streaming stitcher crops it at paste time.
+    """
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return True, None
 
 
 def download_tile_aggressive(
     lat: float, lon: float,
     zoom: int, tile_size_px: int, scale: int,
-    api_key: str, secret: str,
-    crop_bottom: int,
+    url: str,
     output_path: str = None,
-    max_retries: int = 5
+    max_retries: int = 5,
+    limiter: AdaptiveLimiter = None,
+    cache_dir: str = None
 ) -> Tuple[bool, Optional[Image.Image]]:
     """
     Download tile with aggressive retry strategy.
+    Checks the on-disk cache first when cache_dir is set.
     Returns (success, image_or_none).
     """
-    url = build_signed_url(lat, lon, zoom, tile_size_px, scale, api_key, secret)
-    session = _pool.get()
-    
+    if cache_dir:
+        cache_path = _tile_cache_path(cache_dir, lat, lon, zoom, tile_size_px, scale)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    data = f.read()
+                if output_path:
+                    return _write_tile_bytes(data, output_path)
+                return _process_tile_bytes(data)
+            except Exception:
+                pass  # Corrupt cache entry - re-download
+
+    session = get_fast_session()
+
     for attempt in range(max_retries):
         try:
-            response = session.get(url, timeout=10)
-            
+            response = session.get(url, timeout=10, stream=True)
+
             if response.status_code == 200:
+                if limiter:
+                    limiter.on_success()
                 if response.headers.get('content-type', '').startswith('image'):
-                    img = Image.open(BytesIO(response.content))
-                    w, h = img.size
-                    if crop_bottom > 0:
-                        img = img.crop((0, 0, w, h - crop_bottom))
-                    
-                    if output_path:
-                        img.save(output_path, 'JPEG', quality=80)  # Fast compression
-                        img.close()
+                    if output_path and not cache_dir:
+                        # Stream socket -> file; the JPEG bytes are never
+                        # materialized as a Python object
+                        with open(output_path, 'wb') as f:
+                            shutil.copyfileobj(response.raw, f)
                         return True, None
-                    return True, img
+                    data = response.content
+                    if cache_dir:
+                        # Atomic write so a parallel reader never sees a partial tile
+                        tmp_path = cache_path + '.tmp'
+                        with open(tmp_path, 'wb') as f:
+                            f.write(data)
+                        os.replace(tmp_path, cache_path)
+                    if output_path:
+                        return _write_tile_bytes(data, output_path)
+                    return _process_tile_bytes(data)
+                response.close()
                 return False, None
             
             elif response.status_code == 429:
-                # Rate limited - short sleep and retry
+                # Rate limited - back off the controller, short sleep and retry
+                response.close()
+                if limiter:
+                    limiter.on_throttle()
                 time.sleep(0.1 * (attempt + 1))
                 continue
             
             elif response.status_code >= 500:
                 # Server error - retry
+                response.close()
                 time.sleep(0.05 * (attempt + 1))
                 continue
             
             else:
                 # Client error - don't retry
+                response.close()
                 return False, None
                 
         except requests.exceptions.Timeout:
@@ -132,42 +282,41 @@ def download_tile_aggressive(
     return False, None
 
 
-def worker_disk(args):
-    """Worker for disk-based downloads."""
-    req, zoom, tile_size, scale, api_key, secret, crop_bottom, temp_dir = args
-    
-    output_path = os.path.join(temp_dir, f"tile_{req['row']:03d}_{req['col']:03d}.jpg")
-    success, _ = download_tile_aggressive(
-        req['lat'], req['lon'],
-        zoom, tile_size, scale,
-        api_key, secret, crop_bottom,
-        output_path
-    )
-    
-    return {
-        'row': req['row'],
-        'col': req['col'],
-        'index': req['index'],
-        'file': output_path if success else None,
-        'success': success
-    }
+def worker_memory(args):
+    """Worker for in-memory downloads.
 
+    Decoded pixels go straight into the shared mosaic array: tiles write
+    disjoint regions, so no lock is needed, and there is no separate
+    stitch phase afterwards.
+    """
+    req, zoom, tile_size, scale, url, limiter, cache_dir, mosaic, cropped_h, cropped_w = args
+
+    if limiter:
+        limiter.acquire()
+    try:
+        success, img = download_tile_aggressive(
+            req['lat'], req['lon'],
+            zoom, tile_size, scale,
+            url,
+            limiter=limiter,
+            cache_dir=cache_dir
+        )
+    finally:
+        if limiter:
+            limiter.release()
+
+    if success and img is not None:
+        arr = np.asarray(img.convert('RGB'))
+        h = min(arr.shape[0], cropped_h)
+        w = min(arr.shape[1], cropped_w)
+        y = req['row'] * cropped_h
+        x = req['col'] * cropped_w
+        mosaic[y:y + h, x:x + w] = arr[:h, :w]
 
-def worker_memory(args):
-    """Worker for in-memory downloads."""
-    req, zoom, tile_size, scale, api_key, secret, crop_bottom = args
-    
-    success, img = download_tile_aggressive(
-        req['lat'], req['lon'],
-        zoom, tile_size, scale,
-        api_key, secret, crop_bottom
-    )
-    
     return {
         'row': req['row'],
         'col': req['col'],
         'index': req['index'],
-        'image': img,
         'success': success
     }
 
@@ -184,15 +333,19 @@ def download_satellite_map_fast(
     max_workers: int = 50,
     verbose: bool = True,
     output_path: str = None,
-    use_disk: bool = None
+    use_disk: bool = None,
+    adaptive: bool = False,
+    cache_dir: str = None
 ) -> Tuple[Optional[Image.Image], Optional[Dict]]:
     """
     Download satellite mosaic with maximum parallelism.
-    
+
     Args:
         max_workers: Concurrent threads (50-100 recommended with URL signing)
         output_path: Save mosaic directly to this path
         use_disk: Force disk-based (True) or memory-based (False)
+        adaptive: Enable AIMD concurrency control (halve on 429, grow on success)
+        cache_dir: Persist raw tile bytes here and reuse them on re-runs
     """
     if api_key is None:
         api_key = os.environ.get('GOOGLE_MAPS_API_KEY') or os.environ.get('GMAPS_KEY')
@@ -207,37 +360,79 @@ def download_satellite_map_fast(
         lat_min, lat_max, lon_min, lon_max, zoom, tile_size_px
     )
     total_tiles = len(tile_requests)
-    
+
+    # No point spinning up more threads than there are tiles to fetch
+    configured_workers = max_workers
+    max_workers = max(1, min(max_workers, total_tiles))
+
     if use_disk is None:
         use_disk = total_tiles > 150
     
+    limiter = AdaptiveLimiter(max_workers) if adaptive else None
+
+    # Decode the secret and freeze the static query once, then sign every
+    # URL up front: workers do zero crypto or string assembly in the pool
+    sign = make_url_signer(zoom, tile_size_px, scale, api_key, secret)
+    signed_urls = [sign(req['lat'], req['lon']) for req in tile_requests]
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
     if verbose:
         print(f"[Fast] Downloading {total_tiles} tiles ({num_rows}x{num_cols})")
-        print(f"[Fast]   Workers: {max_workers}, Mode: {'disk' if use_disk else 'memory'}")
+        print(f"[Fast]   Workers: {max_workers} (configured {configured_workers}), Mode: {'disk' if use_disk else 'memory'}")
         print(f"[Fast]   URL signing: {'YES' if secret else 'NO'}")
-    
+        if adaptive:
+            print(f"[Fast]   Adaptive concurrency: starting at {max_workers}")
+
+    # Prime the shared session with established TCP+TLS connections so
+    # the first wave of tile fetches skips the handshake round trips
+    warm_count = min(10, max_workers)
+
+    def _warm(_):
+        try:
+            get_fast_session().get('https://maps.googleapis.com/', timeout=5)
+        except Exception:
+            pass  # Warming is best-effort; tile fetches handle their own errors
+
+    with ThreadPoolExecutor(max_workers=warm_count) as executor:
+        list(executor.map(_warm, range(warm_count)))
+
     start_time = time.time()
     temp_dir = None
-    
+
+    actual_tile_size = tile_size_px * scale
+    cropped_h = actual_tile_size - crop_bottom
+    cropped_w = actual_tile_size
+
     try:
         if use_disk:
+            # One memmap'd raw-pixel file instead of N temp JPEGs: workers
+            # decode into their slice of mosaic.raw (the OS pages it out as
+            # needed), and the only JPEG work left is one final encode
             temp_dir = tempfile.mkdtemp(prefix='gmaps_')
-            
+            raw_path = os.path.join(temp_dir, 'mosaic.raw')
+            mosaic_arr = np.memmap(
+                raw_path, dtype=np.uint8, mode='w+',
+                shape=(num_rows * cropped_h, num_cols * cropped_w, 3)
+            )
+
             work_items = [
-                (req, zoom, tile_size_px, scale, api_key, secret, crop_bottom, temp_dir)
-                for req in tile_requests
+                (req, zoom, tile_size_px, scale, url, limiter, cache_dir,
+                 mosaic_arr, cropped_h, cropped_w)
+                for req, url in zip(tile_requests, signed_urls)
             ]
-            
-            results = []
+
+            success_count = 0
             completed = 0
             last_report = 0
-            
+
+            # executor.map: no per-item Future dict and no as_completed
+            # waiter machinery; results arrive in submission order
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {executor.submit(worker_disk, item): item for item in work_items}
-                
-                for future in as_completed(futures):
-                    result = future.result()
-                    results.append(result)
+                for result in executor.map(worker_memory, work_items):
+                    if result['success']:
+                        success_count += 1
                     completed += 1
                     
                     if verbose and (completed - last_report >= 50 or completed == total_tiles):
@@ -247,26 +442,18 @@ def download_satellite_map_fast(
                         last_report = completed
             
             download_time = time.time() - start_time
-            results.sort(key=lambda x: x['index'])
-            success_count = sum(1 for r in results if r['success'])
             
             if verbose:
                 print(f"[Fast] Downloaded {success_count}/{total_tiles} in {download_time:.2f}s")
                 print(f"[Fast]   Throughput: {success_count/download_time:.1f} tiles/sec")
-            
-            if verbose:
-                print(f"[Fast] Stitching...")
+                print(f"[Fast] Encoding mosaic...")
             
             stitch_start = time.time()
-            tile_files = {(r['row'], r['col']): r['file'] for r in results if r['file']}
-            
+            mosaic_arr.flush()
             mosaic_path = output_path if output_path else os.path.join(temp_dir, 'mosaic.jpg')
-            
-            mosaic_size = stitch_mosaic_streaming(
-                tile_files, num_rows, num_cols,
-                tile_size_px, scale, crop_bottom,
-                mosaic_path, quality=85
-            )
+            save_jpeg(mosaic_arr, mosaic_path, quality=85)
+            mosaic_size = (mosaic_arr.shape[1], mosaic_arr.shape[0])
+            del mosaic_arr
             
             stitch_time = time.time() - stitch_start
             
@@ -276,21 +463,26 @@ def download_satellite_map_fast(
             mosaic = None if output_path else Image.open(mosaic_path)
             
         else:
+            # Workers stitch as they go: preallocate the final mosaic and
+            # let each thread slice-assign its own disjoint region
+            mosaic_arr = np.zeros((num_rows * cropped_h, num_cols * cropped_w, 3), dtype=np.uint8)
+
             work_items = [
-                (req, zoom, tile_size_px, scale, api_key, secret, crop_bottom)
-                for req in tile_requests
+                (req, zoom, tile_size_px, scale, url, limiter, cache_dir,
+                 mosaic_arr, cropped_h, cropped_w)
+                for req, url in zip(tile_requests, signed_urls)
             ]
             
-            results = []
+            # Workers write straight into the mosaic, so only the success
+            # count is tracked - no results list, no sort
+            success_count = 0
             completed = 0
             last_report = 0
             
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {executor.submit(worker_memory, item): item for item in work_items}
-                
-                for future in as_completed(futures):
-                    result = future.result()
-                    results.append(result)
+                for result in executor.map(worker_memory, work_items):
+                    if result['success']:
+                        success_count += 1
                     completed += 1
                     
                     if verbose and (completed - last_report >= 50 or completed == total_tiles):
@@ -300,15 +492,12 @@ def download_satellite_map_fast(
                         last_report = completed
             
             download_time = time.time() - start_time
-            results.sort(key=lambda x: x['index'])
-            success_count = sum(1 for r in results if r['success'])
             
             if verbose:
                 print(f"[Fast] Downloaded {success_count}/{total_tiles} in {download_time:.2f}s")
                 print(f"[Fast]   Throughput: {success_count/download_time:.1f} tiles/sec")
             
-            tiles_for_stitch = [{'row': r['row'], 'col': r['col'], 'image': r['image']} for r in results]
-            mosaic = stitch_mosaic(tiles_for_stitch, num_rows, num_cols, tile_size_px, scale, crop_bottom)
+            mosaic = Image.fromarray(mosaic_arr)
             
             if output_path:
                 mosaic.save(output_path, 'JPEG', quality=85)
@@ -320,6 +509,7 @@ def download_satellite_map_fast(
         
         metadata['download_method'] = 'fast_parallel'
         metadata['max_workers'] = max_workers
+        metadata['configured_workers'] = configured_workers
         metadata['tiles_success'] = success_count
         metadata['tiles_total'] = total_tiles
         metadata['download_time'] = download_time
@@ -327,6 +517,9 @@ def download_satellite_map_fast(
         metadata['throughput'] = success_count / download_time if download_time > 0 else 0
         metadata['use_disk'] = use_disk
         metadata['url_signing'] = secret is not None
+        metadata['adaptive'] = adaptive
+        if limiter:
+            metadata['final_concurrency'] = limiter.limit
         
         return mosaic, metadata
         
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+MPI Google Maps Satellite Downloader
+=====================================
+mpi4py tile fetching: each rank downloads a share of the grid, then the
+JPEG payloads travel to rank 0 as one contiguous Gatherv of raw bytes
+plus an int32 index table - no pickling of per-tile dicts. Falls back
+with a clear error if mpi4py is missing.
+
+Run with: mpiexec -n <ranks> python -m mpi4py scripts/maps_mpi.py ...
+"""
+
+import os
+import sys
+import time
+import pickle
+import struct
+from io import BytesIO
+from typing import Tuple, Optional, Dict
+import numpy as np
+from PIL import Image
+
+try:
+    from mpi4py import MPI
+    HAS_MPI = True
+except ImportError:
+    HAS_MPI = False
+else:
+    # Protocol 5 moves large bytes payloads of object sends as
+    # out-of-band buffers - no memcpy into the pickle stream on
+    # either side
+    MPI.pickle.__init__(protocol=max(5, pickle.DEFAULT_PROTOCOL))
+
+sys.path.insert(0, os.path.dirname(__file__))
+from maps_core import calculate_tile_grid, download_single_tile_bytes, stitch_mosaic
+
+
+# Per-tile receive budget for the streaming path; Static API tiles are
+# a few hundred KB at most at scale=2
+_MAX_TILE_BYTES = 1 << 19
+
+# Message tags for the dynamic (master/worker) assignment protocol
+_TAG_READY = 1
+_TAG_WORK = 2
+_TAG_DONE = 3
+_TAG_RESULT = 4
+
+# Framing for dynamic-path results: (row, col, index, nbytes) header
+# followed by the raw JPEG payload, sent as one contiguous buffer
+_HEADER = struct.Struct('<iiiI')
+
+
+def _dynamic_worker(comm, zoom, tile_size_px, scale, api_key, secret):
+    """Pull tiles from rank 0 one at a time until told to stop.
+
+    A worker asks for work whenever it goes idle, so slow tiles (cold
+    generations, 429 backoffs) never strand a pre-assigned block on one
+    rank while the others sit finished. Tile payloads are Google's JPEG
+    bytes verbatim; workers never touch the codec.
+    """
+    status = MPI.Status()
+    while True:
+        comm.send(None, dest=0, tag=_TAG_READY)
+        req = comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+        if status.Get_tag() == _TAG_DONE:
+            return
+        data = download_single_tile_bytes(
+            req['lat'], req['lon'],
+            zoom, tile_size_px, scale,
+            api_key, secret
+        ) or b''
+        payload = bytearray(_HEADER.size + len(data))
+        _HEADER.pack_into(payload, 0, req['row'], req['col'], req['index'], len(data))
+        payload[_HEADER.size:] = data
+        comm.Send([payload, MPI.BYTE], dest=0, tag=_TAG_RESULT)
+
+
+def _dynamic_root(comm, size, tile_requests, verbose):
+    """Hand out tiles on demand and collect results as they arrive.
+
+    Rank 0 acts purely as the dispatcher: per-tile latency variance is
+    absorbed by whichever worker happens to be free, so total time
+    tracks the average tile cost rather than the slowest rank's block.
+    """
+    total_tiles = len(tile_requests)
+    # Indices are dense 0..N-1, so results drop straight into their
+    # slot - deterministic grid order with no sort afterwards
+    ordered = [None] * total_tiles
+    next_idx = 0
+    completed = 0
+    active_workers = size - 1
+    status = MPI.Status()
+
+    while active_workers > 0:
+        comm.Probe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+        src = status.Get_source()
+        if status.Get_tag() == _TAG_READY:
+            comm.recv(source=src, tag=_TAG_READY)
+            if next_idx < total_tiles:
+                comm.send(tile_requests[next_idx], dest=src, tag=_TAG_WORK)
+                next_idx += 1
+            else:
+                comm.send(None, dest=src, tag=_TAG_DONE)
+                active_workers -= 1
+        else:
+            # Framed result: fixed header then the raw JPEG bytes
+            payload = bytearray(status.Get_count(MPI.BYTE))
+            comm.Recv([payload, MPI.BYTE], source=src, tag=_TAG_RESULT)
+            row, col, index, nbytes = _HEADER.unpack_from(payload, 0)
+            completed += 1
+            if nbytes > 0:
+                data = bytes(memoryview(payload)[_HEADER.size:_HEADER.size + nbytes])
+                ordered[index] = {
+                    'row': row,
+                    'col': col,
+                    'image': Image.open(BytesIO(data))
+                }
+            if verbose and (completed % 10 == 0 or completed == total_tiles):
+                print(f"[MPI]   Progress: {completed}/{total_tiles} tiles")
+
+    return [t for t in ordered if t is not None]
+
+
+def _stream_worker(comm, local_requests, zoom, tile_size_px, scale,
+                   api_key, secret):
+    """Non-root streaming side: Isend each tile to rank 0 as it lands.
+
+    Failed tiles are sent as empty messages so rank 0 never waits on a
+    receive that will not complete. Payload buffers are kept alive until
+    Waitall confirms delivery.
+    """
+    handles = []
+    payloads = []
+    for req in local_requests:
+        data = download_single_tile_bytes(
+            req['lat'], req['lon'],
+            zoom, tile_size_px, scale,
+            api_key, secret
+        ) or b''
+        if len(data) > _MAX_TILE_BYTES:
+            # Larger than rank 0's posted receive buffer: sending it
+            # would abort the run with an MPI truncation error, so
+            # treat the tile as failed instead
+            data = b''
+        buf = np.frombuffer(data, dtype=np.uint8)
+        payloads.append(buf)
+        handles.append(comm.Isend([buf, MPI.BYTE], dest=0, tag=req['index']))
+    MPI.Request.Waitall(handles)
+
+
+def _stream_root(comm, size, tile_requests, counts, local_requests,
+                 zoom, tile_size_px, scale, api_key, secret,
+                 verbose):
+    """Rank-0 streaming side: overlap remote receives with own downloads.
+
+    Pre-posts one Irecv per expected remote tile, then drains completed
+    receives between its own tile downloads via Testany, so decode work
+    happens while the network is still busy instead of after a blocking
+    gather.
+    """
+    recv_bufs = []
+    recv_meta = []
+    recv_handles = []
+    offset = counts[0]
+    for r in range(1, size):
+        for req in tile_requests[offset:offset + counts[r]]:
+            buf = np.empty(_MAX_TILE_BYTES, dtype=np.uint8)
+            recv_bufs.append(buf)
+            recv_meta.append((req['row'], req['col'], req['index']))
+            recv_handles.append(comm.Irecv([buf, MPI.BYTE], source=r, tag=req['index']))
+        offset += counts[r]
+
+    # Indexed placement: each tile drops into its dense 0..N-1 slot, so
+    # the final list comes out in grid order with no sort
+    ordered = [None] * len(tile_requests)
+    status = MPI.Status()
+
+    def consume(i):
+        nbytes = status.Get_count(MPI.BYTE)
+        if nbytes > 0:
+            data = recv_bufs[i][:nbytes].tobytes()
+            row, col, index = recv_meta[i]
+            ordered[index] = {'row': row, 'col': col, 'image': Image.open(BytesIO(data))}
+        recv_bufs[i] = None
+
+    for i, req in enumerate(local_requests):
+        data = download_single_tile_bytes(
+            req['lat'], req['lon'],
+            zoom, tile_size_px, scale,
+            api_key, secret
+        )
+        if data is not None:
+            ordered[req['index']] = {
+                'row': req['row'], 'col': req['col'],
+                'image': Image.open(BytesIO(data))
+            }
+
+        if verbose and ((i + 1) % 10 == 0 or i + 1 == len(local_requests)):
+            print(f"[MPI]   Rank 0 progress: {i + 1}/{len(local_requests)} tiles")
+
+        # Drain whatever has already arrived without blocking
+        while recv_handles:
+            idx, flag = MPI.Request.Testany(recv_handles, status)
+            if not flag or idx == MPI.UNDEFINED:
+                break
+            consume(idx)
+
+    # Remote tail: block on the remaining receives
+    while recv_handles:
+        idx = MPI.Request.Waitany(recv_handles, status)
+        if idx == MPI.UNDEFINED:
+            break
+        consume(idx)
+
+    return [t for t in ordered if t is not None]
+
+
+def download_satellite_map_mpi(
+    lat_min: float, lat_max: float,
+    lon_min: float, lon_max: float,
+    zoom: int = 19,
+    tile_size_px: int = 640,
+    scale: int = 2,
+    crop_bottom: int = 40,
+    api_key: str = None,
+    secret: str = None,
+    verbose: bool = True,
+    output_path: str = None,
+    streaming: bool = False,
+    dynamic: bool = False,
+    raw_gather: bool = False
+) -> Tuple[Optional[Image.Image], Optional[Dict]]:
+    """
+    Download satellite mosaic with tiles distributed across MPI ranks.
+
+    Tiles are split in contiguous blocks so each rank's payload occupies
+    one contiguous region of the gathered blob. Payloads and the
+    (row, col, index, nbytes) table are collected with Gatherv - the
+    native collective moves raw buffers, so no pickle pass scales with
+    the mosaic size. Payloads are Google's JPEG responses verbatim:
+    workers never decode, and rank 0 decodes each tile once during
+    stitching (the attribution strip is clipped at placement).
+
+    With streaming=True, workers Isend each tile to rank 0 the moment it
+    finishes instead of holding everything for a bulk gather, and rank 0
+    drains receives between its own downloads - the exchange hides
+    behind the download tail rather than running as a serial phase.
+
+    With dynamic=True (and more than one rank), rank 0 stops downloading
+    and hands tiles to workers one at a time as they go idle - per-tile
+    latency spikes no longer strand a straggler rank with a whole block
+    left to fetch.
+
+    With raw_gather=True, workers decode their tiles and the exchange
+    moves raw uint8 pixels instead of JPEG bytes - rank 0 slices them
+    straight into the mosaic buffer with no decode pass at all. Roughly
+    10x more bytes on the wire, so this trade only pays on fast
+    interconnects (same node, shared memory).
+
+    Args:
+        output_path: Save mosaic directly to this path (rank 0 only)
+        streaming: Overlap the tile exchange with downloads (Isend/Irecv)
+        dynamic: Pull-based tile assignment instead of static blocks
+        raw_gather: Gatherv decoded pixels instead of JPEG bytes
+
+    Returns:
+        (mosaic_image, metadata) on rank 0; (None, None) on other ranks
+    """
+    if not HAS_MPI or MPI.COMM_WORLD.Get_size() == 1:
+        # No MPI (or a single rank): fall back to the threaded fast
+        # path rather than a serial loop - tile downloads are I/O-bound,
+        # so threads recover the parallelism MPI would have provided
+        from maps_fast import download_satellite_map_fast
+        reason = 'mpi4py not installed' if not HAS_MPI else 'single rank'
+        print(f"[MPI] WARNING: {reason}, falling back to threaded download")
+        return download_satellite_map_fast(
+            lat_min, lat_max, lon_min, lon_max,
+            zoom=zoom, tile_size_px=tile_size_px, scale=scale,
+            crop_bottom=crop_bottom, api_key=api_key, secret=secret,
+            verbose=verbose, output_path=output_path
+        )
+
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    if api_key is None:
+        api_key = os.environ.get('GOOGLE_MAPS_API_KEY') or os.environ.get('GMAPS_KEY')
+    if secret is None:
+        secret = os.environ.get('GOOGLE_MAPS_SECRET')
+
+    if not api_key:
+        if rank == 0:
+            print("[MPI] ERROR: No Google Maps API key found!")
+        return None, None
+
+    # Compute the grid once on rank 0 and broadcast: no duplicated work
+    # on the other ranks, and every rank sees bit-identical lat/lon
+    # values (no chance of float divergence across heterogeneous nodes)
+    if rank == 0:
+        grid = calculate_tile_grid(
+            lat_min, lat_max, lon_min, lon_max, zoom, tile_size_px
+        )
+    else:
+        grid = None
+    tile_requests, num_rows, num_cols, metadata = comm.bcast(grid, root=0)
+    total_tiles = len(tile_requests)
+
+    if verbose and rank == 0:
+        print(f"[MPI] Downloading {total_tiles} tiles ({num_rows}x{num_cols}) on {size} ranks")
+        print(f"[MPI]   Zoom: {zoom}, Resolution: ~{metadata['meters_per_pixel']:.2f}m/pixel")
+
+    start_time = time.time()
+
+    # Static contiguous block split (remainder tiles go to the low ranks)
+    base, extra = divmod(total_tiles, size)
+    counts = [base + (1 if r < extra else 0) for r in range(size)]
+    start_idx = sum(counts[:rank])
+    local_requests = tile_requests[start_idx:start_idx + counts[rank]]
+
+    mosaic_img = None
+
+    if dynamic and size > 1:
+        if rank == 0:
+            tiles = _dynamic_root(comm, size, tile_requests, verbose)
+        else:
+            _dynamic_worker(
+                comm, zoom, tile_size_px, scale, api_key, secret
+            )
+            tiles = None
+
+        local_download_time = time.time() - start_time
+        download_time = comm.reduce(local_download_time, op=MPI.MAX, root=0)
+
+        if rank != 0:
+            return None, None
+
+        success_count = len(tiles)
+    elif raw_gather:
+        # Decode on the workers, move raw pixels: one Gatherv of uint8
+        # tile regions plus a success mask, and rank 0 slices each tile
+        # straight into the mosaic buffer - no JPEG anywhere past the
+        # download itself
+        actual_tile_size = tile_size_px * scale
+        cropped_h = actual_tile_size - crop_bottom
+        tile_nbytes = cropped_h * actual_tile_size * 3
+
+        pixels = np.zeros(
+            (len(local_requests), cropped_h, actual_tile_size, 3), dtype=np.uint8
+        )
+        ok = np.zeros(len(local_requests), dtype=np.int8)
+        for i, req in enumerate(local_requests):
+            data = download_single_tile_bytes(
+                req['lat'], req['lon'],
+                zoom, tile_size_px, scale,
+                api_key, secret
+            )
+            if data is not None:
+                arr = np.asarray(Image.open(BytesIO(data)).convert('RGB'))
+                h = min(arr.shape[0], cropped_h)
+                w = min(arr.shape[1], actual_tile_size)
+                pixels[i, :h, :w] = arr[:h, :w]
+                ok[i] = 1
+
+            if verbose and rank == 0 and ((i + 1) % 10 == 0 or i + 1 == len(local_requests)):
+                print(f"[MPI]   Rank 0 progress: {i + 1}/{len(local_requests)} tiles")
+
+        local_download_time = time.time() - start_time
+
+        # Static blocks are contiguous, so position in the gathered
+        # arrays equals the global tile index - no index table needed
+        tile_counts = np.array(counts, dtype=np.int64)
+        pix_counts = tile_counts * tile_nbytes
+        pix_displs = np.zeros(size, dtype=np.int64)
+        pix_displs[1:] = np.cumsum(pix_counts)[:-1]
+        ok_displs = np.zeros(size, dtype=np.int64)
+        ok_displs[1:] = np.cumsum(tile_counts)[:-1]
+
+        if rank == 0:
+            recv_pixels = np.empty(
+                (total_tiles, cropped_h, actual_tile_size, 3), dtype=np.uint8
+            )
+            recv_ok = np.empty(total_tiles, dtype=np.int8)
+        else:
+            recv_pixels = None
+            recv_ok = None
+
+        comm.Gatherv(pixels, [recv_pixels, pix_counts, pix_displs, MPI.BYTE], root=0)
+        comm.Gatherv(ok, [recv_ok, tile_counts, ok_displs, MPI.SIGNED_CHAR], root=0)
+
+        download_time = comm.reduce(local_download_time, op=MPI.MAX, root=0)
+
+        if rank != 0:
+            return None, None
+
+        mosaic_arr = np.zeros(
+            (num_rows * cropped_h, num_cols * actual_tile_size, 3), dtype=np.uint8
+        )
+        for k, req in enumerate(tile_requests):
+            if recv_ok[k]:
+                y_px = req['row'] * cropped_h
+                x_px = req['col'] * actual_tile_size
+                mosaic_arr[y_px:y_px + cropped_h, x_px:x_px + actual_tile_size] = recv_pixels[k]
+        mosaic_img = Image.fromarray(mosaic_arr)
+
+        tiles = None
+        success_count = int(recv_ok.sum())
+    elif streaming:
+        if rank == 0:
+            tiles = _stream_root(
+                comm, size, tile_requests, counts, local_requests,
+                zoom, tile_size_px, scale, api_key, secret,
+                verbose
+            )
+        else:
+            _stream_worker(
+                comm, local_requests, zoom, tile_size_px, scale,
+                api_key, secret
+            )
+            tiles = None
+
+        local_download_time = time.time() - start_time
+        download_time = comm.reduce(local_download_time, op=MPI.MAX, root=0)
+
+        if rank != 0:
+            return None, None
+
+        success_count = len(tiles)
+    else:
+        jpeg_chunks = []
+        index_rows = []
+        for i, req in enumerate(local_requests):
+            data = download_single_tile_bytes(
+                req['lat'], req['lon'],
+                zoom, tile_size_px, scale,
+                api_key, secret
+            )
+            if data is not None:
+                jpeg_chunks.append(data)
+                index_rows.append((req['row'], req['col'], req['index'], len(data)))
+
+            if verbose and rank == 0 and ((i + 1) % 10 == 0 or i + 1 == len(local_requests)):
+                print(f"[MPI]   Rank 0 progress: {i + 1}/{len(local_requests)} tiles")
+
+        local_download_time = time.time() - start_time
+
+        # One contiguous buffer per rank; the index table carries the
+        # per-tile byte lengths needed to re-slice the blob on rank 0
+        local_blob = np.frombuffer(b''.join(jpeg_chunks), dtype=np.uint8)
+        local_index = np.array(index_rows, dtype=np.int32).reshape(-1, 4)
+
+        blob_sizes = np.array(comm.allgather(local_blob.size), dtype=np.int64)
+        tile_counts = np.array(comm.allgather(local_index.shape[0]), dtype=np.int64)
+
+        blob_displs = np.zeros(size, dtype=np.int64)
+        blob_displs[1:] = np.cumsum(blob_sizes)[:-1]
+        index_counts = tile_counts * 4
+        index_displs = np.zeros(size, dtype=np.int64)
+        index_displs[1:] = np.cumsum(index_counts)[:-1]
+
+        if rank == 0:
+            recv_blob = np.empty(int(blob_sizes.sum()), dtype=np.uint8)
+            recv_index = np.empty((int(tile_counts.sum()), 4), dtype=np.int32)
+        else:
+            recv_blob = None
+            recv_index = None
+
+        comm.Gatherv(local_blob, [recv_blob, blob_sizes, blob_displs, MPI.BYTE], root=0)
+        comm.Gatherv(local_index, [recv_index, index_counts, index_displs, MPI.INT32_T], root=0)
+
+        download_time = comm.reduce(local_download_time, op=MPI.MAX, root=0)
+
+        if rank != 0:
+            return None, None
+
+        success_count = recv_index.shape[0]
+
+        # Walk the gathered blob rank by rank; each rank's tiles sit at
+        # its Gatherv displacement in index-table order. Tiles land in
+        # their dense index slot, so the list is in grid order without
+        # a sort
+        ordered = [None] * total_tiles
+        row_cursor = 0
+        for r in range(size):
+            offset = int(blob_displs[r])
+            for _ in range(int(tile_counts[r])):
+                tile_row, tile_col, tile_index, nbytes = recv_index[row_cursor]
+                data = recv_blob[offset:offset + nbytes].tobytes()
+                ordered[int(tile_index)] = {
+                    'row': int(tile_row),
+                    'col': int(tile_col),
+                    'image': Image.open(BytesIO(data))
+                }
+                offset += int(nbytes)
+                row_cursor += 1
+        tiles = [t for t in ordered if t is not None]
+        # Each tile holds its own copy of its bytes now; drop the
+        # gathered blob before the mosaic buffer gets allocated so the
+        # two never coexist at peak
+        del recv_blob, recv_index
+
+    if success_count < total_tiles * 0.5:
+        print(f"[MPI] ERROR: Too many failures ({total_tiles - success_count}/{total_tiles})")
+        return None, None
+
+    if verbose:
+        print(f"[MPI] Downloaded {success_count}/{total_tiles} in {download_time:.2f}s")
+        print(f"[MPI] Stitching...")
+
+    if mosaic_img is not None:
+        mosaic = mosaic_img
+    else:
+        mosaic = stitch_mosaic(tiles, num_rows, num_cols, tile_size_px, scale, crop_bottom)
+
+    if output_path:
+        mosaic.save(output_path, 'JPEG', quality=85, optimize=False, progressive=False, subsampling=2)
+
+    if verbose:
+        print(f"[MPI] Mosaic: {mosaic.size[0]}x{mosaic.size[1]} px")
+
+    elapsed = time.time() - start_time
+
+    metadata['download_method'] = 'mpi'
+    metadata['mpi_ranks'] = size
+    metadata['streaming'] = streaming
+    metadata['dynamic'] = dynamic and size > 1
+    metadata['raw_gather'] = raw_gather
+    metadata['tiles_success'] = success_count
+    metadata['tiles_total'] = total_tiles
+    metadata['download_time'] = download_time
+    metadata['total_time'] = elapsed
+    metadata['throughput'] = success_count / download_time if download_time > 0 else 0
+
+    return mosaic, metadata
@@ -10,12 +10,16 @@ import sys
 import time
 import tempfile
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from io import BytesIO
 from typing import Tuple, Optional, Dict
 from PIL import Image
 
 sys.path.insert(0, os.path.dirname(__file__))
 from maps_core import (
-    calculate_tile_grid, download_single_tile, stitch_mosaic, stitch_mosaic_streaming
+    calculate_tile_grid, download_single_tile_bytes, stitch_mosaic, stitch_mosaic_streaming
 )
 
 
@@ -30,15 +34,21 @@ def download_satellite_map_sequential(
     secret: str = None,
     verbose: bool = True,
     output_path: str = None,
-    use_disk: bool = None
+    use_disk: bool = None,
+    max_workers: int = 1
 ) -> Tuple[Optional[Image.Image], Optional[Dict]]:
     """
     Download satellite mosaic using sequential (single-threaded) method.
-    
+
     Args:
         output_path: If provided, saves mosaic directly to this path
         use_disk: Force disk-based (True) or memory-based (False) processing
-    
+        max_workers: Thread count for tile downloads. The default of 1
+            keeps the strictly serial baseline; higher values fan the
+            blocking HTTP requests out over a thread pool (the GIL is
+            released inside socket reads, so wall-clock drops from
+            N * RTT toward N * RTT / max_workers)
+
     Returns:
         (mosaic_image, metadata) - mosaic_image is None if output_path is set
     """
@@ -64,32 +74,82 @@ def download_satellite_map_sequential(
         print(f"[Sequential] Downloading {total_tiles} tiles ({num_rows}x{num_cols})")
         print(f"[Sequential]   Zoom: {zoom}, Resolution: ~{metadata['meters_per_pixel']:.2f}m/pixel")
         print(f"[Sequential]   Mode: {'disk' if use_disk else 'memory'}")
-    
+        if max_workers > 1:
+            print(f"[Sequential]   Workers: {max_workers}")
+
     start_time = time.time()
     temp_dir = None
-    
+
+    def fetch(req):
+        # Raw JPEG bytes straight off the wire; the attribution strip is
+        # clipped later when the tile is placed into the mosaic
+        return req, download_single_tile_bytes(
+            req['lat'], req['lon'],
+            zoom, tile_size_px, scale,
+            api_key, secret
+        )
+
+    def downloaded():
+        """Yield (req, data) pairs, serially or from a thread pool."""
+        if max_workers <= 1:
+            for req in tile_requests:
+                yield fetch(req)
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, total_tiles)) as executor:
+                futures = [executor.submit(fetch, req) for req in tile_requests]
+                for future in as_completed(futures):
+                    yield future.result()
+
     try:
         if use_disk:
             # Disk-based processing
             temp_dir = tempfile.mkdtemp(prefix='gmaps_seq_')
             tile_files = {}
-            
-            for idx, req in enumerate(tile_requests):
-                img = download_single_tile(
-                    req['lat'], req['lon'],
-                    zoom, tile_size_px, scale,
-                    api_key, secret, crop_bottom
-                )
-                
-                if img:
+
+            # Single background writer drains finished tiles to disk
+            # while the download loop keeps the network busy; the
+            # bounded queue caps how many payloads wait in memory
+            write_queue = Queue(maxsize=32)
+            write_error = []
+
+            def writer():
+                # Every item is acknowledged even when a write fails:
+                # after the first error the writer keeps draining (so
+                # producers never block on the bounded queue and join()
+                # completes) and the exception re-raises in the main
+                # thread below
+                while True:
+                    item = write_queue.get()
+                    try:
+                        if item is None:
+                            return
+                        if not write_error:
+                            tile_path, data = item
+                            with open(tile_path, 'wb') as f:
+                                f.write(data)
+                    except Exception as e:
+                        write_error.append(e)
+                    finally:
+                        write_queue.task_done()
+
+            writer_thread = threading.Thread(target=writer, daemon=True)
+            writer_thread.start()
+
+            for idx, (req, data) in enumerate(downloaded()):
+                if data:
                     tile_path = os.path.join(temp_dir, f"tile_{req['row']:03d}_{req['col']:03d}.jpg")
-                    img.save(tile_path, 'JPEG', quality=92)
-                    img.close()
+                    write_queue.put((tile_path, data))
                     tile_files[(req['row'], req['col'])] = tile_path
-                
+
                 if verbose and ((idx + 1) % 10 == 0 or idx + 1 == total_tiles):
                     print(f"[Sequential]   Progress: {idx + 1}/{total_tiles} tiles")
-            
+
+            write_queue.put(None)
+            write_queue.join()
+            writer_thread.join()
+            if write_error:
+                raise write_error[0]
+
             success_count = len(tile_files)
             
             if success_count < total_tiles * 0.5:
@@ -120,16 +180,11 @@ def download_satellite_map_sequential(
         else:
             # In-memory processing
             tiles = []
-            for idx, req in enumerate(tile_requests):
-                img = download_single_tile(
-                    req['lat'], req['lon'],
-                    zoom, tile_size_px, scale,
-                    api_key, secret, crop_bottom
-                )
+            for idx, (req, data) in enumerate(downloaded()):
                 tiles.append({
                     'row': req['row'],
                     'col': req['col'],
-                    'image': img
+                    'image': Image.open(BytesIO(data)) if data else None
                 })
                 
                 if verbose and ((idx + 1) % 10 == 0 or idx + 1 == total_tiles):
@@ -159,6 +214,7 @@ def download_satellite_map_sequential(
         metadata['tiles_total'] = total_tiles
         metadata['time'] = elapsed
         metadata['use_disk'] = use_disk
+        metadata['max_workers'] = max_workers
         
         return mosaic, metadata
         